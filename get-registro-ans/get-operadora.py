@@ -1,41 +1,190 @@
 # -*- coding: utf-8 -*-
 import os
-import time
+import json
+import asyncio
+import httpx
 import pandas as pd
-import requests
 from tqdm import tqdm
+from http_retry import RETRY_STATUS, RetryableStatus, retry_after_secs, with_backoff
+from rate_limit import RateLimiter
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 INPUT = os.path.join(BASE_DIR, "registro-ans-unificado-com-cnpj.csv")
 OUTPUT = os.path.join(BASE_DIR, "registro-ans-dados-completo.csv")
+ETAGS = os.path.join(BASE_DIR, "etags.json")  # ETag por Registro ANS (sidecar do OUTPUT)
 
-def fetch_ans_data(registro):
-    url = f"https://www.ans.gov.br/operadoras-entity/v1/operadoras/{registro}"
+BASE_URL = "https://www.ans.gov.br/operadoras-entity/v1/operadoras/{registro}"
+
+MAX_CONCURRENCY = 32  # requisições simultâneas em voo
+REQUESTS_PER_SEC = 8  # ritmo máximo p/ não sobrecarregar a API
+TIMEOUT_SECS = 30
+BATCH_SIZE = 500  # grava no CSV de saída a cada N registros concluídos
+REFRESH = False  # True: revalida também os registros já salvos (If-None-Match)
+
+
+@with_backoff(httpx.TransportError)
+async def get_with_retry(client, sem, limiter, url, headers):
+    """GET com retentativa (ver http_retry); libera o semáforo antes de esperar."""
+    async with sem, limiter:
+        resp = await client.get(url, headers=headers)
+    if resp.status_code in RETRY_STATUS:
+        raise RetryableStatus(resp.status_code, retry_after_secs(resp.headers))
+    return resp
+
+
+async def fetch_ans_data(client, sem, limiter, registro, etags, has_row=False):
+    """
+    Busca a operadora na API. Se houver ETag salvo para o registro, envia
+    If-None-Match e retorna None quando a API responde 304 (linha atual vale).
+    Com `has_row` (registro já salvo com sucesso), erros também retornam None:
+    só uma resposta 200 substitui a linha existente.
+    """
+    url = BASE_URL.format(registro=registro)
+    headers = {"accept": "*/*"}
+    if etags.get(registro):
+        headers["If-None-Match"] = etags[registro]
     try:
-        resp = requests.get(url, headers={"accept": "*/*"}, timeout=30)
+        resp = await get_with_retry(client, sem, limiter, url, headers)
+        if resp.status_code == 304:
+            return None
         if resp.status_code == 200:
+            if resp.headers.get("ETag"):
+                etags[registro] = resp.headers["ETag"]
             return resp.json()
-        else:
-            return {"erro": f"HTTP {resp.status_code}"}
+        erro = f"HTTP {resp.status_code}"
     except Exception as e:
-        return {"erro": str(e)}
+        erro = str(e) or type(e).__name__
+    if has_row:
+        tqdm.write(f"✘ Registro {registro} → {erro}; mantendo a linha já salva")
+        return None
+    etags.pop(registro, None)
+    return {"erro": erro}
+
+
+def load_done(input_cols):
+    """
+    Registros já gravados com sucesso no CSV de saída (permite retomar).
+    Só contam como feitos os que têm algum campo da API preenchido e sem erro;
+    os demais são buscados de novo.
+    """
+    if not os.path.exists(OUTPUT):
+        return set(), None
+    df_done = pd.read_csv(OUTPUT, dtype=str).fillna("")
+    columns = df_done.columns.tolist()
+    api_cols = [c for c in columns if c not in input_cols and c != "erro"]
+    if not api_cols:
+        return set(), columns
+    ok = (df_done[api_cols] != "").any(axis=1)
+    if "erro" in columns:
+        ok &= df_done["erro"] == ""
+    return set(df_done.loc[ok, "Registro ANS"]), columns
+
+
+def load_etags(done):
+    """ETags salvos, restritos a registros que já têm linha válida no OUTPUT."""
+    if not os.path.exists(ETAGS):
+        return {}
+    with open(ETAGS, encoding="utf-8") as fh:
+        etags = json.load(fh)
+    return {reg: tag for reg, tag in etags.items() if reg in done}
+
+
+def save_etags(etags):
+    with open(ETAGS, "w", encoding="utf-8") as fh:
+        json.dump(etags, fh, indent=2)
 
-def main():
+
+def compact_output():
+    """Remove linhas repetidas de retentativas, mantendo a mais recente."""
+    df_all = pd.read_csv(OUTPUT, dtype=str)
+    df_dedup = df_all.drop_duplicates(subset=["Registro ANS"], keep="last")
+    if len(df_dedup) < len(df_all):
+        df_dedup.to_csv(OUTPUT, index=False, encoding="utf-8")
+
+
+async def main():
     # Lê CSV original
-    df = pd.read_csv(INPUT)
+    df = pd.read_csv(INPUT, dtype=str).fillna("")
+
+    done, columns = load_done(set(df.columns))
+    etags = load_etags(done)
+    if REFRESH:
+        pending = df.reset_index(drop=True)
+    else:
+        pending = df[~df["Registro ANS"].isin(done)].reset_index(drop=True)
+    registros = pending["Registro ANS"].to_numpy()
+
+    if not len(registros):
+        print("✅ Nada a fazer. Todos os registros já estão em", OUTPUT)
+        return
+
+    print(f"🔎 Buscando dados de {len(registros)} registros ({len(done)} já salvos)...")
+
+    sem = asyncio.BoundedSemaphore(MAX_CONCURRENCY)
+    limiter = RateLimiter(REQUESTS_PER_SEC)
+    # HTTP/2 multiplexa as requisições numa conexão TLS reaproveitada
+    # (se o servidor não suportar, cai para HTTP/1.1 com keep-alive)
+    limits = httpx.Limits(
+        max_connections=MAX_CONCURRENCY, max_keepalive_connections=MAX_CONCURRENCY
+    )
+
+    # buffer de (posição em `pending`, resposta da API) ainda não gravados
+    buffer: list[tuple[int, dict]] = []
+
+    def flush():
+        nonlocal columns
+        if not buffer:
+            return
+        idx = [i for i, _ in buffer]
+        # Junta colunas da API às originais (pandas alinha chaves ausentes)
+        df_api = pd.DataFrame([data for _, data in buffer])
+        part = pd.concat([pending.iloc[idx].reset_index(drop=True), df_api], axis=1)
+        # O cabeçalho é a união das colunas já vistas: se o lote trouxer campos
+        # novos da API, reescreve o arquivo com o cabeçalho ampliado
+        new_cols = [c for c in part.columns if c not in (columns or [])]
+        if columns is None or new_cols:
+            columns = (columns or []) + new_cols
+            if "erro" not in columns:
+                columns.append("erro")
+            if os.path.exists(OUTPUT):
+                part = pd.concat([pd.read_csv(OUTPUT, dtype=str), part])
+            part.reindex(columns=columns).to_csv(
+                OUTPUT, index=False, encoding="utf-8"
+            )
+        else:
+            part.reindex(columns=columns).to_csv(
+                OUTPUT, mode="a", header=False, index=False, encoding="utf-8"
+            )
+        buffer.clear()
+        save_etags(etags)
+
+    async with httpx.AsyncClient(
+        http2=True, limits=limits, timeout=TIMEOUT_SECS
+    ) as client:
+        with tqdm(total=len(registros)) as pbar:
+
+            async def run(i, registro):
+                data = await fetch_ans_data(
+                    client, sem, limiter, registro, etags, has_row=registro in done
+                )
+                pbar.update(1)
+                if data is None:
+                    # 304 (ou erro em registro já salvo): a linha atual continua válida
+                    return
+                buffer.append((i, data))
+                # salva em lote
+                if len(buffer) >= BATCH_SIZE:
+                    flush()
 
-    results = []
-    for _, row in tqdm(df.iterrows(), total=len(df)):
-        registro = row["Registro ANS"]
-        data = fetch_ans_data(registro)
-        merged = {**row.to_dict(), **data}
-        results.append(merged)
-        time.sleep(0.8)  # pequena pausa p/ não sobrecarregar a API
+            try:
+                await asyncio.gather(*(run(i, r) for i, r in enumerate(registros)))
+            finally:
+                # salva o restante (inclusive se a execução for interrompida)
+                flush()
 
-    # Salva CSV na mesma pasta do script
-    df_out = pd.DataFrame(results)
-    df_out.to_csv(OUTPUT, index=False, encoding="utf-8")
+    compact_output()
+    print(f"\n✅ Arquivo atualizado: {OUTPUT}")
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
@@ -1,57 +1,43 @@
 # -*- coding: utf-8 -*-
 import os
-import time
 import re
+import asyncio
+import httpx
 import pandas as pd
 from tqdm import tqdm
-
-# Selenium
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from webdriver_manager.chrome import ChromeDriverManager
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException, StaleElementReferenceException
+from http_retry import RETRY_STATUS, RetryableStatus, retry_after_secs, with_backoff
+from rate_limit import RateLimiter
 
 # ------------------------------------------------------------
 # Config
 # ------------------------------------------------------------
-BASE_URL = "https://www.ans.gov.br/ConsultaPlanosConsumidor/pages/ConsultaPlanos.xhtml"
-USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/112 Safari/537.36"
+BASE_URL = "https://www.ans.gov.br/operadoras-entity/v1/operadoras/{registro}"
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 INPUT_CSV = os.path.join(SCRIPT_DIR, "registro-ans-unificado.csv")
 OUTPUT_CSV = os.path.join(SCRIPT_DIR, "registro-ans-unificado-com-cnpj.csv")
+# checkpoint intermediário (Parquet); o CSV acima é só o entregável final
+OUTPUT_PARQ = os.path.join(SCRIPT_DIR, "registro-ans-unificado-com-cnpj.parquet")
 
-REQUEST_SLEEP = 0.5  # intervalo entre requisições (segundos)
+MAX_CONCURRENCY = 16  # requisições simultâneas à API da ANS
+REQUESTS_PER_SEC = 8  # mesmo ritmo do get-operadora.py (mesmo endpoint)
 BATCH_SIZE = 10  # salva a cada N registros processados
-WAIT_SECS = 15  # timeout de espera do Selenium
+TIMEOUT_SECS = 15  # timeout de cada requisição
 
 CNPJ_REGEX = re.compile(r"\b\d{2}\.\d{3}\.\d{3}/\d{4}-\d{2}\b")
-
-
-# ------------------------------------------------------------
-# Selenium setup
-# ------------------------------------------------------------
-def make_driver():
-    chrome_opts = webdriver.ChromeOptions()
-    chrome_opts.add_argument("--headless=new")
-    chrome_opts.add_argument("--no-sandbox")
-    chrome_opts.add_argument("--disable-dev-shm-usage")
-    chrome_opts.add_argument(f"--user-agent={USER_AGENT}")
-    chrome_opts.add_argument("--window-size=1200,900")
-    service = Service(ChromeDriverManager().install())
-    return webdriver.Chrome(service=service, options=chrome_opts)
+_WS_RE = re.compile(r"\s+")
+_DIGITS_RE = re.compile(r"\D")
 
 
 # ------------------------------------------------------------
 # CSV helpers
 # ------------------------------------------------------------
 def _clean(s: str) -> str:
-    import re as _re
+    return _WS_RE.sub(" ", s or "").strip()
+
 
-    return _re.sub(r"\s+", " ", (s or "")).strip()
+def only_digits(s: str) -> str:
+    return _DIGITS_RE.sub("", s or "")
 
 
 def load_inputs() -> pd.DataFrame:
@@ -63,131 +49,146 @@ def load_inputs() -> pd.DataFrame:
     return df
 
 
+def load_existing() -> pd.DataFrame | None:
+    """Progresso salvo: checkpoint Parquet se houver, senão o CSV final."""
+    if os.path.exists(OUTPUT_PARQ):
+        return pd.read_parquet(OUTPUT_PARQ).fillna("")
+    if os.path.exists(OUTPUT_CSV):
+        return pd.read_csv(OUTPUT_CSV, dtype=str).fillna("")
+    return None
+
+
+def save_checkpoint(df: pd.DataFrame):
+    df.to_parquet(OUTPUT_PARQ, engine="pyarrow", compression="zstd", index=False)
+
+
+def write_output(df: pd.DataFrame):
+    """
+    Grava o CSV final e descarta o checkpoint: senão, na próxima execução o
+    Parquet (lido antes do CSV) esconderia correções feitas no CSV.
+    """
+    df.to_csv(OUTPUT_CSV, index=False, encoding="utf-8")
+    if os.path.exists(OUTPUT_PARQ):
+        os.remove(OUTPUT_PARQ)
+
+
 def merge_with_existing(df_in: pd.DataFrame) -> pd.DataFrame:
-    if not os.path.exists(OUTPUT_CSV):
-        out = df_in.copy()
-        if "CNPJ" not in out.columns:
-            out["CNPJ"] = ""
-        return out
+    df_out = load_existing()
+    if df_out is None:
+        # assign só acrescenta a coluna; evita o .copy() profundo do frame todo
+        return df_in.assign(CNPJ=df_in.get("CNPJ", ""))
 
-    df_out = pd.read_csv(OUTPUT_CSV, dtype=str).fillna("")
     if "CNPJ" not in df_out.columns:
         df_out["CNPJ"] = ""
 
-    merge_keys = [
-        c
-        for c in ["Registro ANS", "Razão Social", "Nome Fantasia"]
-        if c in df_in.columns and c in df_out.columns
-    ] or ["Registro ANS"]
-
-    merged = pd.merge(df_in, df_out[merge_keys + ["CNPJ"]], on=merge_keys, how="left")
+    # Junta pelo índice "Registro ANS" (hash único) em vez de chaves compostas
+    old = df_out.drop_duplicates("Registro ANS", keep="last").set_index("Registro ANS")
+    merged = df_in.set_index("Registro ANS").join(old[["CNPJ"]], how="left", rsuffix="_old")
+    if "CNPJ_old" in merged.columns:
+        # entrada já tinha CNPJ: só completa os vazios com o que já foi salvo
+        merged["CNPJ"] = merged["CNPJ"].where(merged["CNPJ"].str.len() > 0, merged["CNPJ_old"])
+        merged = merged.drop(columns="CNPJ_old")
     merged["CNPJ"] = merged["CNPJ"].fillna("")
-    return merged
+    return merged.reset_index()
 
 
 # ------------------------------------------------------------
-# Scraping com Selenium
+# API da ANS
 # ------------------------------------------------------------
-def extract_cnpj_text(text: str) -> str:
-    m = CNPJ_REGEX.search(text or "")
-    return m.group(0) if m else ""
-
-
-def fetch_cnpj(driver: webdriver.Chrome, registro_ans: str) -> str:
+def normalize_cnpj(value: str) -> str:
     """
-    Acessa a URL da operadora e tenta extrair o CNPJ:
-      1) por ID direto: formConsulta:outCNPJ
-      2) por XPath relativo ao rótulo "CNPJ:"
-      3) fallback: regex no HTML inteiro
-    Retorna string do CNPJ ou ''.
+    Normaliza o CNPJ para o formato 00.000.000/0000-00.
+    Aceita tanto o valor já formatado quanto só os dígitos (como vem da API).
     """
-    url = f"{BASE_URL}?coOperadora={str(registro_ans)}"
-    driver.get(url)
-    wait = WebDriverWait(driver, WAIT_SECS)
-
-    # 1) Tenta por ID direto
-    for attempt in range(2):  # pequena tolerância a staleness
-        try:
-            el = wait.until(
-                EC.presence_of_element_located((By.ID, "formConsulta:outCNPJ"))
-            )
-            cnpj = extract_cnpj_text(el.text)
-            if cnpj:
-                return cnpj
-        except (TimeoutException, StaleElementReferenceException):
-            if attempt == 0:
-                try:
-                    driver.refresh()
-                except Exception:
-                    pass
-
-    # 2) XPath relativo ao rótulo "CNPJ:"
-    try:
-        # pega a TD do valor do CNPJ (rótulo seguido do valor)
-        val_el = wait.until(
-            EC.presence_of_element_located(
-                (
-                    By.XPATH,
-                    "//table[contains(@class,'tabela-cpc')]//tr[.//label[normalize-space()='CNPJ:']]/td[2]//label",
-                )
-            )
-        )
-        cnpj = extract_cnpj_text(val_el.text)
-        if cnpj:
-            return cnpj
-    except (TimeoutException, StaleElementReferenceException):
-        pass
-
-    # 3) Fallback regex no HTML
+    m = CNPJ_REGEX.search(value or "")
+    if m:
+        return m.group(0)
+    d = only_digits(value)
+    if len(d) != 14:
+        return ""
+    return f"{d[:2]}.{d[2:5]}.{d[5:8]}/{d[8:12]}-{d[12:]}"
+
+
+@with_backoff(httpx.TransportError)
+async def fetch_cnpj(
+    client: httpx.AsyncClient,
+    sem: asyncio.Semaphore,
+    limiter: RateLimiter,
+    registro_ans: str,
+) -> str:
+    """
+    Consulta a API JSON de operadoras da ANS e extrai o campo `cnpj`.
+    Erros de rede e 429/502/503/504 são repetidos (ver http_retry).
+    Retorna string do CNPJ formatado ou ''.
+    """
+    url = BASE_URL.format(registro=registro_ans)
+    async with sem, limiter:
+        resp = await client.get(url, headers={"accept": "application/json"})
+    if resp.status_code in RETRY_STATUS:
+        raise RetryableStatus(resp.status_code, retry_after_secs(resp.headers))
+    if resp.status_code != 200:
+        return ""
+    payload = resp.json()
+    return normalize_cnpj(str((payload or {}).get("cnpj") or ""))
+
+
+async def fetch_cnpj_or_blank(client, sem, limiter, registro_ans: str) -> str:
+    """fetch_cnpj (que já faz as retentativas), com '' se todas falharem."""
     try:
-        html = driver.page_source or ""
-        cnpj = extract_cnpj_text(html)
-        if cnpj:
-            return cnpj
+        return await fetch_cnpj(client, sem, limiter, registro_ans)
     except Exception:
-        pass
-
-    return ""
+        return ""
 
 
 # ------------------------------------------------------------
 # Main
 # ------------------------------------------------------------
-def main():
+async def main():
     df_base = load_inputs()
     df_out = merge_with_existing(df_base)
 
     # Garante criar arquivo de saída desde o início (facilita retomada)
-    if not os.path.exists(OUTPUT_CSV):
-        df_out.to_csv(OUTPUT_CSV, index=False, encoding="utf-8")
-
-    # Índices que ainda precisam ser preenchidos (CNPJ vazio)
-    pending_idx = [i for i, v in enumerate(df_out["CNPJ"].tolist()) if not _clean(v)]
+    if not os.path.exists(OUTPUT_PARQ):
+        save_checkpoint(df_out)
+
+    # Índices que ainda precisam ser preenchidos (CNPJ vazio), decididos de uma vez
+    # com máscaras vetorizadas; registros não numéricos nem chegam a ir para a API
+    cnpj_vazio = df_out["CNPJ"].str.strip() == ""
+    reg_valido = df_out["Registro ANS"].str.strip().str.fullmatch(r"\d+")
+    invalidos = df_out.loc[cnpj_vazio & ~reg_valido, "Registro ANS"].tolist()
+    if invalidos:
+        tqdm.write(f"⚠ Ignorando {len(invalidos)} registros ANS inválidos: {invalidos}")
+    pending_idx = df_out.index[cnpj_vazio & reg_valido].tolist()
 
     if not pending_idx:
+        write_output(df_out)
         print("✅ Nada a fazer. Todos os CNPJs já estão preenchidos em", OUTPUT_CSV)
         return
 
     print(f"🔎 Buscando CNPJ para {len(pending_idx)} registros...")
 
-    processed_since_save = 0
-    driver = make_driver()
-    try:
-        for i in tqdm(pending_idx, desc="Processando"):
-            reg = _clean(str(df_out.at[i, "Registro ANS"]))
-            cnpj = ""
-
-            try:
-                cnpj = fetch_cnpj(driver, reg)
-                if not cnpj:
-                    # segunda tentativa "light"
-                    time.sleep(1.0)
-                    cnpj = fetch_cnpj(driver, reg)
-            except Exception:
-                cnpj = ""
-
-            df_out.at[i, "CNPJ"] = cnpj
-            processed_since_save += 1
+    sem = asyncio.Semaphore(MAX_CONCURRENCY)
+    limiter = RateLimiter(REQUESTS_PER_SEC)
+
+    async def run(client, i):
+        reg = _clean(str(df_out.at[i, "Registro ANS"]))
+        return i, reg, await fetch_cnpj_or_blank(client, sem, limiter, reg)
+
+    # Resultados pendentes de gravação: {índice da linha: {coluna: valor}}
+    updates: dict[int, dict] = {}
+
+    def flush():
+        # Uma única atribuição alinhada por índice no lugar de N `.at[...]`
+        df_out.update(pd.DataFrame.from_dict(updates, orient="index"))
+        save_checkpoint(df_out)
+        updates.clear()
+
+    async with httpx.AsyncClient(http2=True, timeout=TIMEOUT_SECS) as client:
+        tasks = [run(client, i) for i in pending_idx]
+        for fut in tqdm(asyncio.as_completed(tasks), total=len(tasks), desc="Processando"):
+            i, reg, cnpj = await fut
+
+            updates[i] = {"CNPJ": cnpj}
 
             if cnpj:
                 tqdm.write(f"✔ Registro {reg} → CNPJ {cnpj}")
@@ -195,27 +196,20 @@ def main():
                 tqdm.write(f"✘ Registro {reg} → CNPJ não encontrado")
 
             # salva em lote
-            if processed_since_save >= BATCH_SIZE:
-                df_out.to_csv(OUTPUT_CSV, index=False, encoding="utf-8")
-                processed_since_save = 0
-
-            time.sleep(REQUEST_SLEEP)
+            if len(updates) >= BATCH_SIZE:
+                flush()
 
-        # salva o restante
-        if processed_since_save > 0:
-            df_out.to_csv(OUTPUT_CSV, index=False, encoding="utf-8")
-            time.sleep(REQUEST_SLEEP * 3)
+    # salva o restante
+    if updates:
+        flush()
 
-        total_ok = (df_out["CNPJ"].str.len() > 0).sum()
-        print(f"\n✅ Arquivo atualizado: {OUTPUT_CSV}")
-        print(f"Linhas: {len(df_out)} | Com CNPJ preenchido: {total_ok}")
+    # CSV só uma vez, no fim, para quem consome o resultado
+    write_output(df_out)
 
-    finally:
-        try:
-            driver.quit()
-        except Exception:
-            pass
+    total_ok = (df_out["CNPJ"].str.len() > 0).sum()
+    print(f"\n✅ Arquivo atualizado: {OUTPUT_CSV}")
+    print(f"Linhas: {len(df_out)} | Com CNPJ preenchido: {total_ok}")
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
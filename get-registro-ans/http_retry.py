@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+Retentativa de chamadas HTTP compartilhada pelos scripts da pasta.
+
+Backoff exponencial com jitter (tenacity); em respostas 429/502/503/504 o
+chamador levanta `RetryableStatus` e, se o servidor mandou Retry-After, a
+espera usa esse valor no lugar do backoff.
+"""
+from tenacity import (
+    retry,
+    retry_if_exception_type,
+    stop_after_attempt,
+    wait_exponential_jitter,
+)
+from tenacity.wait import wait_base
+
+RETRY_STATUS = {429, 502, 503, 504}  # respostas transitórias (throttle/instabilidade)
+MAX_RETRY_AFTER = 60  # teto (s) para o Retry-After informado pelo servidor
+
+
+class RetryableStatus(Exception):
+    """Resposta HTTP em RETRY_STATUS; `retry_after` em segundos, se informado."""
+
+    def __init__(self, status, retry_after=None):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+        self.retry_after = retry_after
+
+
+def retry_after_secs(headers):
+    """Retry-After em segundos (limitado a MAX_RETRY_AFTER) ou None."""
+    try:
+        return min(float(headers.get("Retry-After")), MAX_RETRY_AFTER)
+    except (TypeError, ValueError):  # ausente ou em formato de data
+        return None
+
+
+class wait_retry_after(wait_base):
+    """Usa o Retry-After da última resposta; sem ele, cai no `fallback`."""
+
+    def __init__(self, fallback):
+        self.fallback = fallback
+
+    def __call__(self, retry_state):
+        exc = retry_state.outcome.exception()
+        if isinstance(exc, RetryableStatus) and exc.retry_after is not None:
+            return exc.retry_after
+        return self.fallback(retry_state)
+
+
+def with_backoff(*network_errors):
+    """
+    Decorator (sync ou async): até 5 tentativas em `network_errors` e
+    `RetryableStatus`; a última exceção é repassada ao chamador.
+    A espera acontece fora da função decorada, ou seja, sem segurar
+    semáforos/limitadores adquiridos dentro dela.
+    """
+    return retry(
+        wait=wait_retry_after(wait_exponential_jitter(initial=1, max=30)),
+        stop=stop_after_attempt(5),
+        retry=retry_if_exception_type((*network_errors, RetryableStatus)),
+        reraise=True,
+    )
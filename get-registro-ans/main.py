@@ -1,26 +1,45 @@
-# pip install selenium webdriver-manager pandas beautifulsoup4 lxml
+# pip install "selenium>=4.11" "httpx[http2]" pandas selectolax tenacity
 
-from datetime import date
+import os
 import re
 import time
+import xml.etree.ElementTree as ET
+from urllib.parse import urljoin
+import httpx
 import pandas as pd
-from bs4 import BeautifulSoup
+from selectolax.lexbor import LexborHTMLParser
+from http_retry import RETRY_STATUS, RetryableStatus, retry_after_secs, with_backoff
 
 from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from webdriver_manager.chrome import ChromeDriverManager
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException
 
 URL = "https://www.ans.gov.br/ConsultaPlanosConsumidor/pages/home.xhtml"
 
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# entrada do get_cnpj.py; só é substituída quando todas as páginas vierem
+OUTPUT = os.path.join(BASE_DIR, "registro-ans-unificado.csv")
+OUTPUT_PART = OUTPUT + ".part"
+
 # === Seletores específicos do seu HTML ===
 TBODY_SEL = "#formHome\\:tabOperadora\\:tblOperadoras_data"
 SEARCH_BTN = "#formHome\\:tabOperadora\\:j_idt16"
 PAGINATOR_CURRENT = "#formHome\\:tabOperadora\\:tblOperadoras_paginator_bottom .ui-paginator-current"
-BTN_NEXT = "#formHome\\:tabOperadora\\:tblOperadoras_paginator_bottom a.ui-paginator-next"
+
+# === Requisição Ajax do paginador PrimeFaces ===
+FORM_ID = "formHome"
+TABLE_ID = "formHome:tabOperadora:tblOperadoras"
+SEARCH_BTN_ID = "formHome:tabOperadora:j_idt16"
+VIEWSTATE_SEL = "input[name='javax.faces.ViewState']"
+
+COLUMNS = ["Registro ANS", "Razão Social", "Nome Fantasia"]
+FLUSH_PAGES = 50  # grava no CSV de saída a cada N páginas coletadas
+AJAX_HEADERS = {
+    "Faces-Request": "partial/ajax",
+    "X-Requested-With": "XMLHttpRequest",
+    "Content-Type": "application/x-www-form-urlencoded; charset=UTF-8",
+}
 
 def new_driver(headless=True):
     opts = webdriver.ChromeOptions()
@@ -29,7 +48,18 @@ def new_driver(headless=True):
     opts.add_argument("--no-sandbox")
     opts.add_argument("--disable-dev-shm-usage")
     opts.add_argument("--window-size=1600,1200")
-    return webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=opts)
+    # Só precisamos do HTML da tabela: não baixa imagens, CSS nem fontes
+    opts.add_argument("--blink-settings=imagesEnabled=false")
+    opts.add_experimental_option("prefs", {
+        "profile.managed_default_content_settings.images": 2,
+        "profile.managed_default_content_settings.stylesheets": 2,
+        "profile.managed_default_content_settings.fonts": 2,
+    })
+    # driver.get retorna no DOMContentLoaded; as esperas explícitas cuidam do resto
+    opts.page_load_strategy = "eager"
+    # Selenium Manager (embutido desde o Selenium 4.11) resolve e cacheia o
+    # chromedriver localmente; não há download/checagem de versão a cada execução.
+    return webdriver.Chrome(options=opts)
 
 def wait_clickable_and_click(driver, by, sel, timeout=30):
     el = WebDriverWait(driver, timeout).until(EC.element_to_be_clickable((by, sel)))
@@ -52,34 +82,41 @@ def parse_current_total(texto):
         return None, None
     return int(m.group(1)), int(m.group(2))
 
-def get_current_and_total(driver):
-    try:
-        span = WebDriverWait(driver, 30).until(
-            EC.presence_of_element_located((By.CSS_SELECTOR, PAGINATOR_CURRENT))
-        )
-        return parse_current_total(span.text.strip())
-    except TimeoutException:
-        return None, None
+# Um único round-trip WebDriver devolve o texto (ou '' se ainda não existe)
+INNER_TEXT_JS = "const e = document.querySelector(arguments[0]); return e && e.innerText || '';"
 
-def extract_page_data(driver):
+def get_current_and_total(driver, timeout=30):
     """
-    Snapshot do TBODY -> parse com BeautifulSoup.
-    Evita StaleElementReferenceException em DOM PrimeFaces.
+    Lê '1 de 139' do paginador com execute_script, em vez de
+    WebDriverWait + find + .text (um round-trip por chamada, não três).
     """
-    tbody = get_tbody(driver)
-    html = driver.execute_script("return arguments[0].outerHTML;", tbody)
-    soup = BeautifulSoup(html, "lxml")
+    deadline = time.monotonic() + timeout
+    while True:
+        texto = driver.execute_script(INNER_TEXT_JS, PAGINATOR_CURRENT)
+        if texto:
+            return parse_current_total(texto.strip())
+        if time.monotonic() >= deadline:
+            return None, None
+        time.sleep(0.1)
+
+def parse_rows(html):
+    """
+    Converte as <tr> da tabela de operadoras em dicts (selectolax, em C).
+    Aceita tanto o <tbody> completo quanto só as <tr> do retorno Ajax.
+    """
+    # <tbody>/<tr> soltos são descartados pelo parser HTML5; embrulha numa <table>
+    tree = LexborHTMLParser(f"<table>{html}</table>")
 
     data = []
-    for tr in soup.select("tbody > tr"):
-        tds = tr.select("td")
+    for tr in tree.css("tr"):
+        tds = tr.css("td")
         if len(tds) < 3:
             continue
 
-        a = tds[0].find("a")
-        registro = (a.get_text(strip=True) if a else tds[0].get_text(strip=True))
-        razao = tds[1].get_text(strip=True)
-        fantasia = tds[2].get_text(strip=True)
+        a = tds[0].css_first("a")
+        registro = (a.text(strip=True) if a else tds[0].text(strip=True))
+        razao = tds[1].text(strip=True)
+        fantasia = tds[2].text(strip=True)
 
         data.append({
             "Registro ANS": registro,
@@ -88,85 +125,237 @@ def extract_page_data(driver):
         })
     return data
 
-def click_next_and_wait(driver, expected_next_page=None):
+def extract_page_data(driver):
     """
-    Clica 'Próximo' e sincroniza:
-    - espera o TBODY antigo ficar stale (trocado via Ajax)
-    - espera novo TBODY aparecer
-    - (opcional) espera current page == expected_next_page
+    Snapshot do TBODY -> parse_rows.
+    Evita StaleElementReferenceException em DOM PrimeFaces.
     """
-    old_tbody = get_tbody(driver)
+    tbody = get_tbody(driver)
+    html = driver.execute_script("return arguments[0].outerHTML;", tbody)
+    return parse_rows(html)
 
-    nxt = WebDriverWait(driver, 30).until(
-        EC.element_to_be_clickable((By.CSS_SELECTOR, BTN_NEXT))
-    )
-    # Se o botão estiver disabled por classe, aborta
-    if "ui-state-disabled" in (nxt.get_attribute("class") or ""):
-        return False
+def bootstrap(driver):
+    """
+    Usa o navegador uma única vez: abre a página, clica "Pesquisar" e
+    captura o necessário para paginar sem Selenium (URL do form, ViewState,
+    cookies), além da 1ª página já renderizada.
+    """
+    driver.get(URL)
 
-    driver.execute_script("arguments[0].scrollIntoView({block:'center'});", nxt)
-    nxt.click()
+    # Clicar "Pesquisar" (Por Operadora)
+    wait_clickable_and_click(driver, By.CSS_SELECTOR, SEARCH_BTN)
+    get_tbody(driver)  # bloqueia até tabela existir
+
+    # total None se o paginador não for lido; main() trata como coleta incompleta
+    _, total = get_current_and_total(driver)
+
+    return {
+        "action": driver.execute_script(
+            "return document.getElementById(arguments[0]).action;", FORM_ID
+        ),
+        "viewstate": driver.execute_script(
+            "return document.querySelector(arguments[0]).value;", VIEWSTATE_SEL
+        ),
+        "cookies": driver.get_cookies(),
+        "rows": extract_page_data(driver),
+        "total": total,
+    }
+
+@with_backoff(httpx.TransportError)
+def post_with_retry(client, url, data):
+    """POST Ajax com retentativa em erro de rede e 429/502/503/504 (ver http_retry)."""
+    resp = client.post(url, data=data, headers=AJAX_HEADERS)
+    if resp.status_code in RETRY_STATUS:
+        raise RetryableStatus(resp.status_code, retry_after_secs(resp.headers))
+    resp.raise_for_status()
+    return resp
+
+def fetch_page(client, action, viewstate, first, rows):
+    """
+    Reproduz o POST Ajax do paginador PrimeFaces e devolve
+    (linhas da página, ViewState atualizado).
+    """
+    data = {
+        "javax.faces.partial.ajax": "true",
+        "javax.faces.source": TABLE_ID,
+        "javax.faces.partial.execute": TABLE_ID,
+        "javax.faces.partial.render": TABLE_ID,
+        f"{TABLE_ID}_pagination": "true",
+        f"{TABLE_ID}_first": str(first),
+        f"{TABLE_ID}_rows": str(rows),
+        f"{TABLE_ID}_encodeFeature": "true",
+        FORM_ID: FORM_ID,
+        "javax.faces.ViewState": viewstate,
+    }
+    resp = post_with_retry(client, action, data)
+    updates = parse_partial(resp)
+    viewstate = updates.get("viewstate") or viewstate
+    if TABLE_ID not in updates:
+        return None, viewstate
+    return parse_rows(updates[TABLE_ID]), viewstate
 
-    # 1) espera o tbody antigo "morrer"
+def parse_partial(resp):
+    """
+    <partial-response><changes><update id="..."><![CDATA[...]]></update>...
+    -> {id: conteúdo}; o ViewState atualizado vem na chave "viewstate".
+    """
+    updates = {}
+    for upd in ET.fromstring(resp.content).iter("update"):
+        upd_id = upd.get("id") or ""
+        if "javax.faces.ViewState" in upd_id:
+            updates["viewstate"] = (upd.text or "").strip()
+        else:
+            updates[upd_id] = upd.text or ""
+    return updates
+
+def bootstrap_http(client):
+    """
+    Tenta o mesmo que `bootstrap`, mas só com HTTP: GET na home, POST Ajax do
+    botão "Pesquisar" pedindo para renderizar a tabela. Retorna None se a
+    resposta não trouxer a tabela esperada (aí cai para o Selenium).
+    """
     try:
-        WebDriverWait(driver, 30).until(EC.staleness_of(old_tbody))
-    except TimeoutException:
-        # fallback: aguarda um tico
-        time.sleep(1.2)
+        resp = client.get(URL)
+        resp.raise_for_status()
+        tree = LexborHTMLParser(resp.text)
+        form = next(
+            (f for f in tree.css("form") if f.attributes.get("id") == FORM_ID), None
+        )
+        if form is None:
+            return None
 
-    # 2) espera o novo tbody "nascer"
-    get_tbody(driver)
+        # serializa o form como o navegador faria, + parâmetros Ajax do botão
+        data = {
+            i.attributes["name"]: i.attributes.get("value") or ""
+            for i in form.css("input")
+            if i.attributes.get("name")
+            and (i.attributes.get("type") or "text") not in ("submit", "button", "checkbox", "radio")
+        }
+        data.update({
+            "javax.faces.partial.ajax": "true",
+            "javax.faces.source": SEARCH_BTN_ID,
+            "javax.faces.partial.execute": FORM_ID,
+            "javax.faces.partial.render": TABLE_ID,
+            SEARCH_BTN_ID: SEARCH_BTN_ID,
+            FORM_ID: FORM_ID,
+        })
+        action = urljoin(URL, form.attributes.get("action") or URL)
+        updates = parse_partial(post_with_retry(client, action, data))
+        if TABLE_ID not in updates:
+            return None
 
-    # 3) opcional: garante que a página avançou
-    if expected_next_page is not None:
-        try:
-            WebDriverWait(driver, 30).until(
-                lambda d: (get_current_and_total(d)[0] or 0) >= expected_next_page
-            )
-        except TimeoutException:
-            pass
-    return True
+        table = LexborHTMLParser(updates[TABLE_ID])
+        tbody = next(
+            (t for t in table.css("tbody") if t.attributes.get("id") == f"{TABLE_ID}_data"),
+            None,
+        )
+        if tbody is None:
+            return None
+        rows = parse_rows(tbody.html)
+        if not rows:
+            return None
+
+        # sem "1 de N" não dá para saber quantas páginas há: deixa o Selenium tentar
+        paginator = table.css_first(".ui-paginator-current")
+        if paginator is None:
+            return None
+        _, total = parse_current_total(paginator.text())
+        if not total:
+            return None
+        return {
+            "action": action,
+            "viewstate": updates.get("viewstate") or data.get("javax.faces.ViewState", ""),
+            "rows": rows,
+            "total": total,
+        }
+    except Exception as e:
+        print(f"Bootstrap via HTTP falhou ({e}); usando o navegador.")
+        return None
+
+def load_driver_cookies(client, cookies):
+    """
+    Troca a sessão do cliente pela do navegador. Limpa antes: o GET do
+    bootstrap_http deixou um JSESSIONID próprio, que seria enviado junto
+    (e na frente) do JSESSIONID do Selenium.
+    """
+    client.cookies.clear()
+    for c in cookies:
+        client.cookies.set(
+            c["name"], c["value"], domain=c.get("domain", ""), path=c.get("path", "/")
+        )
 
 def main():
-    today = date.today().strftime("%Y-%m-%d")
-    driver = new_driver(headless=True)
-    try:
-        driver.get(URL)
-
-        # Clicar "Pesquisar" (Por Operadora)
-        wait_clickable_and_click(driver, By.CSS_SELECTOR, SEARCH_BTN)
-        get_tbody(driver)  # bloqueia até tabela existir
-
-        current, total = get_current_and_total(driver)
-        if not current or not total:
-            # fallback leve, mas normalmente já vem "1 de N"
-            current, total = 1, 1
-
-        while True:
-            # Revalida a cada iteração
-            current, total = get_current_and_total(driver)
-            if current is None:
-                current = 1
-
-            print(f"Coletando página {current} de {total}…")
-            rows = extract_page_data(driver)
-            df = pd.DataFrame(rows, columns=["Registro ANS", "Razão Social", "Nome Fantasia"])
-            out = f"{current}-{today}.csv"
-            df.to_csv(out, index=False, encoding="utf-8")
-            print(f"Salvo: {out} ({len(df)} linhas)")
-
-            if total is None or current >= total:
-                print("Finalizado. 🚀")
-                break
-
-            # Avança e sincroniza esperando ir pra current+1
-            ok = click_next_and_wait(driver, expected_next_page=current + 1)
-            if not ok:
-                print("Botão 'Próximo' indisponível. Encerrando.")
-                break
-
-    finally:
-        driver.quit()
+    # linhas acumuladas em memória; vão para um único CSV em lotes de páginas
+    all_rows = []
+    written = 0
+
+    def flush():
+        nonlocal written
+        if not all_rows:
+            return
+        df = pd.DataFrame(all_rows, columns=COLUMNS)
+        df.to_csv(OUTPUT_PART, mode="a" if written else "w", header=not written,
+                  index=False, encoding="utf-8")
+        written += len(df)
+        all_rows.clear()
+
+    # um único cliente HTTP para a execução toda (bootstrap + paginação)
+    with httpx.Client(http2=True, timeout=30) as client:
+        # Chromium só se a home não puder ser resolvida por HTTP puro
+        boot = bootstrap_http(client)
+        if boot is None:
+            driver = new_driver(headless=True)
+            try:
+                boot = bootstrap(driver)
+            finally:
+                driver.quit()
+            load_driver_cookies(client, boot["cookies"])
+
+        total = boot["total"]
+        rows = boot["rows"]
+        # tamanho da página vem da própria 1ª página
+        page_size = len(rows)
+        viewstate = boot["viewstate"]
+
+        print(f"Coletando página 1 de {total}…")
+        all_rows.extend(rows)
+
+        # sem total de páginas ou tamanho de página não há como paginar com
+        # segurança: salva só o parcial e não substitui o OUTPUT
+        complete = bool(total and page_size)
+        if not complete:
+            print("Total de páginas ou tamanho da página desconhecido. Encerrando.")
+        last_page = total if complete else 1
+        try:
+            for current in range(2, last_page + 1):
+                print(f"Coletando página {current} de {total}…")
+                rows, viewstate = fetch_page(
+                    client, boot["action"], viewstate, (current - 1) * page_size, page_size
+                )
+                if rows is None:
+                    print("Resposta Ajax sem a tabela. Encerrando.")
+                    complete = False
+                    break
+                all_rows.extend(rows)
+
+                if current % FLUSH_PAGES == 0:
+                    flush()
+        finally:
+            # salva o restante (inclusive se a execução for interrompida)
+            flush()
+
+    # só a última página pode vir incompleta
+    if complete and not (total - 1) * page_size < written <= total * page_size:
+        print(f"Esperava até {total * page_size} linhas ({total} páginas), vieram {written}.")
+        complete = False
+
+    if not complete:
+        print(f"Coleta incompleta; parcial em {OUTPUT_PART} ({written} linhas)")
+        return
+
+    os.replace(OUTPUT_PART, OUTPUT)
+    print(f"Salvo: {OUTPUT} ({written} linhas)")
+    print("Finalizado. 🚀")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""
+Limite de ritmo compartilhado pelos scripts que chamam a API da ANS.
+"""
+import time
+import asyncio
+
+
+class RateLimiter:
+    """
+    Token bucket assíncrono: libera no máximo `rate` requisições por segundo,
+    permitindo rajadas de até `capacity`.
+    Uso: `async with limiter: ...`
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc):
+        return False